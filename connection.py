@@ -52,6 +52,10 @@ def build_database_url(host, protocol='mysql', username='root', password='', por
     return result
 
 
+# server versions keyed by (host, port), shared by every connection of the run
+_server_versions = {}
+
+
 class DatabaseConnection(object):
     """A lightweight wrapper around MySQLdb DB-API"""
 
@@ -64,8 +68,11 @@ class DatabaseConnection(object):
 
     @property
     def version(self):
-        result = self.execute("SELECT VERSION() as version")
-        return result[0]['version']
+        key = (self.host, self.port)
+        if key not in _server_versions:
+            result = self.execute("SELECT VERSION() as version")
+            _server_versions[key] = result[0]['version']
+        return _server_versions[key]
 
     def execute(self, sql, values=None):
         cursor = self._db.cursor()
@@ -83,6 +90,17 @@ class DatabaseConnection(object):
         a = [dict(zip(fields, row)) for row in rows]
         return a
 
+    def execute_stream(self, sql, values=None):
+        """Execute sql on an unbuffered cursor, yielding the rows one at a time"""
+        cursor = self._db.cursor(pymysql.cursors.SSDictCursor)
+        if isinstance(values, str):
+            values = (values,)
+        try:
+            cursor.execute(sql, values)
+            yield from cursor
+        finally:
+            cursor.close()
+
     def connect(self, connection_url, charset):
         """Connect to the database"""
 
@@ -106,6 +124,7 @@ class DatabaseConnection(object):
         """Close the database connection."""
         if self._db is not None:
             self._db.close()
+            self._db = None
 
     def __del__(self):
         self.close()
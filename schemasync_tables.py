@@ -3,12 +3,16 @@
 import sys
 import os
 import logging
+import logging.handlers
 import datetime
 import warnings
 import argparse
 import syncdb
 import utils
 import json
+import itertools
+import colorlog
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from connection import parse_database_url, DatabaseError, DatabaseConnection
 from schema import SchemaObject
 
@@ -36,28 +40,35 @@ except ImportError:
 
 APPLICATION_VERSION = __version__
 APPLICATION_NAME = "Schema Sync"
-LOG_FILENAME = "schemasync.log"
 DATE_FORMAT = "%Y%m%d"
 TPL_DATE_FORMAT = "%a, %b %d, %Y"
-PATCH_TPL = """--
+PATCH_HEADER_TPL = """--
 -- Schema Sync %(app_version)s %(type)s
 -- Created: %(created)s
 -- Server Version: %(server_version)s
 -- Apply To: %(target_host)s:%(target_port)s/%(target_database)s
 --
 
-%(data)s"""
+"""
+PATCH_FOOTER = ""
+# the schema name is always bound as a parameter (escaped by PyMySQL), never formatted in
+EXISTS_TABLES_SQL = """
+SELECT TABLE_NAME FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE'
+"""
+STRIP_NEWLINE = str.maketrans('', '', '\n')
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
 def set_log_format():
-    import logging.handlers
-    import colorlog
-
     global logger
 
+    # already configured
+    if logger.handlers:
+        return
+
     # set logger color
     log_colors_config = {
         'DEBUG': 'bold_purple',
@@ -213,6 +224,13 @@ def parse_cmd_line(fn):
                             default=False,
                             help="New feature: only sync the exists tables in target")
 
+        parser.add_argument("--max-workers",
+                            dest="max_workers",
+                            type=int,
+                            default=4,
+                            help="New feature: number of schemas to sync concurrently "
+                                 "when both source and target database are '*'")
+
         parser.add_argument("--url",
                             dest="alert_url",
                             type=str,
@@ -239,7 +257,6 @@ def parse_cmd_line(fn):
                          targetdb=args.target_db[0],
                          version_filename=args.version_filename,
                          output_directory=args.output_directory,
-                         log_directory=os.getcwd(),
                          no_date=args.no_date,
                          tag=args.tag,
                          charset=args.charset,
@@ -251,19 +268,23 @@ def parse_cmd_line(fn):
                          filter_procedures=args.filter_procedures,
                          only_sync_exists_tables=args.only_sync_exists_tables,
                          alert_url=args.alert_url,
+                         max_workers=args.max_workers,
                          ))
 
     return processor
 
 
 def app(sourcedb='', targetdb='', version_filename=False,
-        output_directory=None, log_directory=None, no_date=False,
+        output_directory=None, no_date=False,
         tag=None, charset=None, sync_auto_inc=False, sync_comments=False,
         filter_tables=None, filter_views=None, filter_triggers=None, filter_procedures=None,
-        only_sync_exists_tables=False, alert_url=None):
+        only_sync_exists_tables=False, alert_url=None, max_workers=4, today=None):
     """Main Application"""
 
-    options = locals()
+    if today is None:
+        today = datetime.datetime.now().strftime(DATE_FORMAT)
+
+    options = syncdb.SyncOptions(sync_auto_inc=sync_auto_inc, sync_comments=sync_comments)
 
     if not os.path.isabs(output_directory):
         print("Error: Output directory must be an absolute path. Quiting.")
@@ -273,23 +294,6 @@ def app(sourcedb='', targetdb='', version_filename=False,
         print("Error: Output directory does not exist. Quiting.")
         return 1
 
-    if not log_directory or not os.path.isdir(log_directory):
-        if log_directory:
-            print("Log directory does not exist, writing log to %s" % output_directory)
-        log_directory = output_directory
-
-    if not os.path.isdir(os.path.join(log_directory, 'logs')):
-        os.makedirs(os.path.join(log_directory, 'logs'), exist_ok=True)
-
-    logging.basicConfig(filename=os.path.join(log_directory, 'logs', LOG_FILENAME),
-                        level=logging.INFO,
-                        format='[%(levelname)s  %(asctime)s] %(message)s')
-
-    console = logging.StreamHandler()
-    console.setLevel(logging.DEBUG)
-    if len(logging.getLogger('').handlers) <= 1:
-        logging.getLogger('').addHandler(console)
-
     if not sourcedb:
         logging.error("Source database URL not provided. Exiting.")
         return 1
@@ -335,20 +339,41 @@ def app(sourcedb='', targetdb='', version_filename=False,
         SELECT SCHEMA_NAME FROM information_schema.SCHEMATA
         WHERE SCHEMA_NAME NOT IN ('mysql', 'information_schema', 'performance_schema', 'sys')
         """
-        schemas = connection.execute(sql_schema)
-        for schema_info in schemas:
-            db = schema_info['SCHEMA_NAME']
-            sourcedb = sourcedb_none + db
-            targetdb = targetdb_none + db
-            try:
-                app(sourcedb=sourcedb, targetdb=targetdb, version_filename=version_filename,
-                    output_directory=output_directory, log_directory=log_directory, no_date=no_date,
-                    tag=tag, charset=charset, sync_auto_inc=sync_auto_inc, sync_comments=sync_comments,
-                    filter_tables=filter_tables, filter_views=filter_views, filter_triggers=filter_triggers,
-                    filter_procedures=filter_procedures, only_sync_exists_tables=only_sync_exists_tables,
-                    alert_url=alert_url)
-            except DatabaseError as e:
-                logging.error("MySQL Error %d: %s (Ignore)" % (e.args[0], e.args[1]))
+        # the cap has to fit both servers, every worker connects to each of them
+        target_connection = DatabaseConnection()
+        target_connection.connect(targetdb_none, charset='utf8')
+        max_connections = min(_get_max_connections(connection), _get_max_connections(target_connection))
+        target_connection.close()
+
+        app_kwargs = dict(version_filename=version_filename, output_directory=output_directory,
+                          no_date=no_date, tag=tag, charset=charset,
+                          sync_auto_inc=sync_auto_inc, sync_comments=sync_comments,
+                          filter_tables=filter_tables, filter_views=filter_views,
+                          filter_triggers=filter_triggers, filter_procedures=filter_procedures,
+                          only_sync_exists_tables=only_sync_exists_tables, alert_url=alert_url,
+                          today=today)
+
+        # every worker holds two connections (source and target), stay below the server limit
+        workers = min(max(1, max_workers or 1), max(1, max_connections // 2))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            # workers start on the first schemas while the listing is still streaming
+            futures = {executor.submit(_sync_one_schema, schema_info['SCHEMA_NAME'],
+                                       sourcedb_none, targetdb_none, app_kwargs): schema_info['SCHEMA_NAME']
+                       for schema_info in connection.execute_stream(sql_schema)}
+            connection.close()
+
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except DatabaseError as e:
+                    logging.error("MySQL Error %d: %s (Ignore)" % (e.args[0], e.args[1]))
+                except Exception:
+                    logging.exception("Failed syncing schema %s" % futures[future])
+        finally:
+            # on Ctrl-C drop the queued schemas instead of syncing them first
+            connection.close()
+            executor.shutdown(wait=False, cancel_futures=True)
         return 1
 
     source_obj = SchemaObject(sourcedb, charset)
@@ -364,23 +389,19 @@ def app(sourcedb='', targetdb='', version_filename=False,
                       % (APPLICATION_NAME, target_obj.version))
         return 1
 
+    sync_tables = True
     if only_sync_exists_tables:
-        # from schemaobject.connection import DatabaseConnection
-
-        connection = DatabaseConnection()
-        connection.connect(targetdb, charset='utf8')
-        sql_tables = """
-        SHOW TABLES FROM %s
-        """ % target_obj.selected.name
-        tables = connection.execute(sql_tables)
-        key = 'Tables_in_%s' % target_obj.selected.name
-        filter_tables = list(map(lambda d: d[key], tables))
-        connection.close()
+        # reuse the target connection instead of opening a new one
+        connection = target_obj.connection
+        tables = connection.execute(EXISTS_TABLES_SQL, target_obj.selected.name)
+        if tables:
+            filter_tables = [t['TABLE_NAME'] for t in tables]
+        else:
+            # an empty filter means "all tables" to syncdb, skip the table sync instead
+            sync_tables = False
 
     # data transformation filters
-    filters = (lambda d: utils.REGEX_MULTI_SPACE.sub(' ', d),
-               lambda d: utils.REGEX_DISTANT_SEMICOLIN.sub(';', d),
-               lambda d: utils.REGEX_SEMICOLON_EXPLODE_TO_NEWLINE.sub(";\n", d))
+    filters = (utils.filter_patch,)
 
     # Information about this run, used in the patch/revert templates
     ctx = dict(app_version=APPLICATION_VERSION,
@@ -394,71 +415,47 @@ def app(sourcedb='', targetdb='', version_filename=False,
     p_fname, r_fname = utils.create_pnames(target_obj.selected.name,
                                            tag=tag,
                                            date_format=DATE_FORMAT,
-                                           no_date=no_date)
+                                           no_date=no_date,
+                                           today=today)
 
     ctx['type'] = "Patch Script"
     p_buffer = utils.PatchBuffer(name=os.path.join(output_directory, p_fname),
-                                 filters=filters, tpl=PATCH_TPL, ctx=ctx.copy(),
-                                 version_filename=version_filename)
+                                 filters=filters, tpl=PATCH_HEADER_TPL, ctx=ctx.copy(),
+                                 version_filename=version_filename, footer=PATCH_FOOTER)
 
     ctx['type'] = "Revert Script"
     r_buffer = utils.PatchBuffer(name=os.path.join(output_directory, r_fname),
-                                 filters=filters, tpl=PATCH_TPL, ctx=ctx.copy(),
-                                 version_filename=version_filename)
-
-    db_selected = False
-    for patch, revert in syncdb.sync_schema(source_obj.selected,
-                                            target_obj.selected, options,
-                                            filter_tables=filter_tables):
-        if patch and revert:
-            if not db_selected:
-                p_buffer.write(target_obj.selected.select() + '\n')
-                r_buffer.write(target_obj.selected.select() + '\n')
-                p_buffer.write(target_obj.selected.fk_checks(0) + '\n')
-                r_buffer.write(target_obj.selected.fk_checks(0) + '\n')
-                db_selected = True
-
-            p_buffer.write(patch + '\n')
-            r_buffer.write(revert + '\n')
-
-    if db_selected:
-        p_buffer.write(target_obj.selected.fk_checks(1) + '\n')
-        r_buffer.write(target_obj.selected.fk_checks(1) + '\n')
-
-    for patch, revert in syncdb.sync_views(source_obj.selected, target_obj.selected,
-                                           filter_views=filter_views):
-        if patch and revert:
-            if not db_selected:
-                p_buffer.write(target_obj.selected.select() + '\n')
-                r_buffer.write(target_obj.selected.select() + '\n')
-                db_selected = True
+                                 filters=filters, tpl=PATCH_HEADER_TPL, ctx=ctx.copy(),
+                                 version_filename=version_filename, footer=PATCH_FOOTER)
+
+    # statements shared by every diff, computed once
+    select_sql = target_obj.selected.select() + '\n'
+    fk_checks_off = target_obj.selected.fk_checks(0) + '\n'
+    fk_checks_on = target_obj.selected.fk_checks(1) + '\n'
+
+    state = dict(db_selected=False)
+    if sync_tables:
+        _write_diffs(syncdb.sync_schema(source_obj.selected, target_obj.selected, options,
+                                        filter_tables=filter_tables),
+                     p_buffer, r_buffer, state, select_sql + fk_checks_off)
+    else:
+        logging.warning("No tables exist in target %s, skipping table sync" % target_obj.selected.name)
 
-            p_buffer.write(patch + '\n')
-            r_buffer.write(revert + '\n')
+    if state['db_selected']:
+        p_buffer.write(fk_checks_on)
+        r_buffer.write(fk_checks_on)
 
-    for patch, revert in syncdb.sync_triggers(source_obj.selected, target_obj.selected,
-                                              filter_triggers=filter_triggers):
-        if patch and revert:
-            if not db_selected:
-                p_buffer.write(target_obj.selected.select() + '\n')
-                r_buffer.write(target_obj.selected.select() + '\n')
-                db_selected = True
+    _write_diffs(syncdb.sync_views(source_obj.selected, target_obj.selected,
+                                   filter_views=filter_views),
+                 p_buffer, r_buffer, state, select_sql)
 
-            p_buffer.write(patch + '\n')
-            r_buffer.write(revert + '\n')
+    _write_diffs(syncdb.sync_triggers(source_obj.selected, target_obj.selected,
+                                      filter_triggers=filter_triggers),
+                 p_buffer, r_buffer, state, select_sql)
 
-    for patch, revert in syncdb.sync_procedures(source_obj.selected, target_obj.selected,
-                                                filter_procedures=filter_procedures):
-        if patch and revert:
-            if not db_selected:
-                p_buffer.write(target_obj.selected.select() + '\n')
-                r_buffer.write(target_obj.selected.select() + '\n')
-                p_buffer.write(target_obj.selected.fk_checks(0) + '\n')
-                r_buffer.write(target_obj.selected.fk_checks(0) + '\n')
-                db_selected = True
-
-            p_buffer.write(patch + '\n')
-            r_buffer.write(revert + '\n')
+    _write_diffs(syncdb.sync_procedures(source_obj.selected, target_obj.selected,
+                                        filter_procedures=filter_procedures),
+                 p_buffer, r_buffer, state, select_sql + fk_checks_off)
 
     if not p_buffer.modified:
         print(("No migration scripts written."
@@ -503,10 +500,38 @@ def app(sourcedb='', targetdb='', version_filename=False,
     return 0
 
 
+def _write_diffs(diffs, p_buffer, r_buffer, state, prelude):
+    """Write the (patch, revert) pairs of ``diffs`` to the buffers.
+       ``prelude`` is written first if no database has been selected yet in ``state``.
+    """
+    for patch, revert in diffs:
+        if patch and revert:
+            if not state['db_selected']:
+                p_buffer.write(prelude)
+                r_buffer.write(prelude)
+                state['db_selected'] = True
+
+            p_buffer.write(patch + '\n')
+            r_buffer.write(revert + '\n')
+
+
+def _get_max_connections(connection):
+    """Return the max_connections setting of the connected server"""
+    return int(connection.execute("SELECT @@max_connections AS max_connections")[0]['max_connections'])
+
+
+def _sync_one_schema(db, sourcedb_none, targetdb_none, app_kwargs):
+    """Sync a single schema of a wildcard run, ``app_kwargs`` are the other keyword arguments of ``app``"""
+    kwargs = dict(app_kwargs)
+    kwargs.update(sourcedb=sourcedb_none + db, targetdb=targetdb_none + db)
+    return app(**kwargs)
+
+
 def send_alert(filename, source_addr, target_addr, alert_url):
     if os.path.isfile(filename):
+        # skip the 7 template header lines
         with open(filename, encoding='utf8') as f:
-            infos = list(map(lambda s: s.replace('\n', ''), f.readlines()))[7:]
+            infos = [ln.translate(STRIP_NEWLINE) for ln in itertools.islice(f, 7, None)]
 
         infos_msg = "\n".join(infos)
         alert_msg = f'【源实例库】{source_addr}\n' \
@@ -533,5 +558,10 @@ def main():
 
 
 if __name__ == "__main__":
+    # answer --version before setting up the log handlers and files
+    if '-V' in sys.argv[1:] or '--version' in sys.argv[1:]:
+        print(APPLICATION_NAME, __version__)
+        sys.exit(0)
+
     set_log_format()
     main()
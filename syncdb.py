@@ -1,5 +1,8 @@
+from collections import namedtuple
 from utils import REGEX_TABLE_AUTO_INC, REGEX_TABLE_COMMENT
 
+SyncOptions = namedtuple('SyncOptions', ['sync_auto_inc', 'sync_comments'])
+
 
 def sync_schema(fromdb, todb, options, filter_tables=None):
     """Generate the SQL statements needed to sync two Databases and all of
@@ -8,7 +11,7 @@ def sync_schema(fromdb, todb, options, filter_tables=None):
     Args:
         fromdb: A SchemaObject Schema Instance.
         todb: A SchemaObject Schema Instance.
-        options: dictionary of options to use when syncing schemas
+        options: SyncOptions to use when syncing schemas
             sync_auto_inc: Bool, sync auto inc value throughout the schema?
             sync_comments: Bool, sync comment fields trhoughout the schema?
         filter_tables: List (default=None), filter tables?
@@ -27,14 +30,14 @@ def sync_schema(fromdb, todb, options, filter_tables=None):
         )
 
     for p, r in sync_created_tables(fromdb.tables, todb.tables,
-                                    sync_auto_inc=options['sync_auto_inc'],
-                                    sync_comments=options['sync_comments'],
+                                    sync_auto_inc=options.sync_auto_inc,
+                                    sync_comments=options.sync_comments,
                                     filter_tables=filter_tables):
         yield p, r
 
     for p, r in sync_dropped_tables(fromdb.tables, todb.tables,
-                                    sync_auto_inc=options['sync_auto_inc'],
-                                    sync_comments=options['sync_comments'],
+                                    sync_auto_inc=options.sync_auto_inc,
+                                    sync_comments=options.sync_comments,
                                     filter_tables=filter_tables):
         yield p, r
 
@@ -66,7 +69,7 @@ def sync_table(from_table, to_table, options):
     Args:
         from_table: A SchemaObject TableSchema Instance.
         to_table: A SchemaObject TableSchema Instance.
-        options: dictionary of options to use when syncing schemas
+        options: SyncOptions to use when syncing schemas
             sync_auto_inc: Bool, sync auto inc value throughout the table?
             sync_comments: Bool, sync comment fields trhoughout the table?
 
@@ -75,18 +78,18 @@ def sync_table(from_table, to_table, options):
     """
     for p, r in sync_created_columns(from_table.columns,
                                      to_table.columns,
-                                     sync_comments=options['sync_comments']):
+                                     sync_comments=options.sync_comments):
         yield (p, r)
 
     for p, r in sync_dropped_columns(from_table.columns,
                                      to_table.columns,
-                                     sync_comments=options['sync_comments']):
+                                     sync_comments=options.sync_comments):
         yield (p, r)
 
     if from_table and to_table:
         for p, r in sync_modified_columns(from_table.columns,
                                           to_table.columns,
-                                          sync_comments=options['sync_comments']):
+                                          sync_comments=options.sync_comments):
             yield (p, r)
 
         # add new indexes, then compare existing indexes for changes
@@ -114,8 +117,8 @@ def sync_table(from_table, to_table, options):
 
         # end the alter table syntax with the changed table options
         p, r = sync_table_options(from_table, to_table,
-                                  sync_auto_inc=options['sync_auto_inc'],
-                                  sync_comments=options['sync_comments'])
+                                  sync_auto_inc=options.sync_auto_inc,
+                                  sync_comments=options.sync_comments)
         if p:
             yield (p, r)
 
@@ -3,10 +3,9 @@
 import re
 import os
 import datetime
-import glob
+import functools
 # import cStringIO
-import io
-import operator
+import tempfile
 import json
 import requests
 
@@ -18,6 +17,56 @@ REGEX_FILE_COUNTER = re.compile(r"_(?P<i>[0-9]+)\.(?:[^.]+)$")
 REGEX_TABLE_COMMENT = re.compile(r"COMMENT(?:(?:\s*=\s*)|\s*)'(.*?)'", re.I)
 REGEX_TABLE_AUTO_INC = re.compile(r"AUTO_INCREMENT(?:(?:\s*=\s*)|\s*)(\d+)", re.I)
 REGEX_SEMICOLON_EXPLODE_TO_NEWLINE = re.compile(r';\s+')
+# REGEX_DISTANT_SEMICOLIN, REGEX_SEMICOLON_EXPLODE_TO_NEWLINE and REGEX_MULTI_SPACE in one pass
+# stdlib re on purpose: re2's \s is ASCII only, and re.M would widen the trailing semicolon rule
+REGEX_PATCH_FILTERS = re.compile(r'(\s+;$)|(;\s+(?!\s*;$))|(\s\s+)')
+
+# chunk size used when copying a PatchBuffer to disk
+WRITE_CHUNK_SIZE = 1024 * 1024
+
+
+def _patch_filters_repl(m):
+    if m.group(1):
+        return ';'
+    if m.group(2):
+        return ';\n'
+    return ' '
+
+
+def filter_patch(data):
+    """Collapse whitespace and put each statement of the patch data on its own line.
+
+       Args:
+            data: string, patch data
+
+       Returns:
+            String, filtered patch data.
+    """
+    return REGEX_PATCH_FILTERS.sub(_patch_filters_repl, data)
+
+
+def _file_counter(dirname, basename, ext):
+    """Scan dirname in a single pass for basename*ext files.
+
+       Returns:
+            tuple (found, counter), whether any file matched and
+            the highest _<i> counter among them (0 if none).
+    """
+    found = False
+    max_i = 0
+    try:
+        names = os.listdir(dirname)
+    except FileNotFoundError:
+        return found, max_i
+
+    for name in names:
+        if not (name.startswith(basename) and name.endswith(ext)):
+            continue
+        found = True
+        m = REGEX_FILE_COUNTER.search(name)
+        if m and int(m.group('i')) > max_i:
+            max_i = int(m.group('i'))
+    return found, max_i
 
 
 def versioned(filename):
@@ -33,22 +82,15 @@ def versioned(filename):
             String, New filename.
     """
     name, ext = os.path.splitext(filename)
-    files = glob.glob(name + '*' + ext)
-    if not files:
+    dirname, basename = os.path.split(name)
+    found, i = _file_counter(dirname or os.curdir, basename, ext)
+    if not found:
         return filename
 
-    files = map(lambda x: REGEX_FILE_COUNTER.search(x, re.I), files)
-    file_counters = [i.group('i') for i in files if i]
+    return name + ('_%d' % (i + 1)) + ext
 
-    if file_counters:
-        i = int(max(file_counters)) + 1
-    else:
-        i = 1
 
-    return name + ('_%d' % i) + ext
-
-
-def create_pnames(db, tag=None, date_format="%Y%m%d", no_date=False):
+def create_pnames(db, tag=None, date_format="%Y%m%d", no_date=False, today=None):
     """Returns a tuple of the filenames to use to create the migration scripts.
        Filename format: <db>[_<tag>].<date=DATE_FORMAT>.(patch|revert).sql
 
@@ -58,11 +100,12 @@ def create_pnames(db, tag=None, date_format="%Y%m%d", no_date=False):
             date_format: string, the current date format
                          Default Format: 21092009
             no_date: bool
+            today: string, optional, the already formatted current date
 
         Returns:
             tuple of strings (patch_filename, revert_filename)
     """
-    d = datetime.datetime.now().strftime(date_format)
+    d = today or datetime.datetime.now().strftime(date_format)
     if tag:
         tag = re.sub('[^A-Za-z0-9_-]', '_', tag)
         if '__' in tag:
@@ -92,8 +135,9 @@ def send_msg_2_fei_shu(url, msg, title='', at_user_id_list: list = None, is_at_a
         content[0]['text'] = msg_content
         msg_json['content']['post']['zh_cn']['title'] = msg_title
         msg_json['content']['post']['zh_cn']['content'] = [content]
-        value = json.dumps(msg_json)
-        resp = requests.post(url, data=value, headers=headers)
+        # compact, unescaped utf-8 keeps the payload small
+        value = json.dumps(msg_json, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        resp = session.post(url, data=value, headers=headers)
         print('[SEND_MSG_TO_FEI_SHU_RESULT] ' + resp.text)
 
     if is_at_all:
@@ -137,25 +181,29 @@ def send_msg_2_fei_shu(url, msg, title='', at_user_id_list: list = None, is_at_a
 
     msg = str(msg)
     title = str(title)
-    msg_len = len(msg)
-    sep = 20000
-    if msg_len > sep:
-        i = 1
-        begin = 0
-        end = begin + sep
-        last_new_line_idx = 0
-
-        while end < msg_len:
-            if i != 1:
-                end = begin + sep
-            new_line_idx = msg[:end].rfind('\n')
-            end = new_line_idx + 1 if new_line_idx != -1 and new_line_idx != last_new_line_idx else end + 1
-            send_msg(msg[begin:end], title + '【数据长度超出限制，分批次发送】【第 %s 批】' % i)
-            begin = end
-            last_new_line_idx = new_line_idx
-            i += 1
-    else:
-        send_msg(msg, title)
+    # one session per call, so the batches of a long message reuse a keep-alive connection
+    # without sharing a Session between the threads of a wildcard run
+    with requests.Session() as session:
+        msg_len = len(msg)
+        sep = 20000
+        if msg_len > sep:
+            i = 1
+            begin = 0
+            while begin < msg_len:
+                window_end = min(begin + sep, msg_len)
+                # cut after the last new line of the window, unless this is the tail
+                new_line_idx = msg.rfind('\n', begin, window_end)
+                end = new_line_idx + 1 if window_end < msg_len and new_line_idx > begin else window_end
+                send_msg(msg[begin:end], title + '【数据长度超出限制，分批次发送】【第 %s 批】' % i)
+                begin = end
+                i += 1
+        else:
+            send_msg(msg, title)
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_version(v, separator=r'[.-]'):
+    return tuple(int(p) for p in re.split(separator, v) if p.isdigit())
 
 
 def compare_version(x, y, separator=r'[.-]'):
@@ -169,16 +217,31 @@ def compare_version(x, y, separator=r'[.-]'):
         Returns:
             integer representing the compare result of version x and y.
     """
-    x_array = re.split(separator, x)
-    y_array = re.split(separator, y)
-    for index in range(min(len(x_array), len(y_array))):
-        if x_array[index] != y_array[index]:
-            try:
-                # return cmp(int(x_array[index]), int(y_array[index]))
-                return operator.eq(int(x_array[index]), int(y_array[index]))
-            except ValueError:
-                return 0
-    return 0
+    a = _parse_version(x, separator)
+    b = _parse_version(y, separator)
+    return (a > b) - (a < b)
+
+
+if hasattr(os, 'writev'):
+    _writev = os.writev
+else:
+    def _writev(fd, buffers):
+        return os.write(fd, buffers[0])
+
+
+def _write_buffers(fd, buffers):
+    """Write all buffers to the file descriptor, using os.writev where available"""
+    buffers = [memoryview(b) for b in buffers if b]
+    while buffers:
+        n = _writev(fd, buffers)
+        # drop what was written, keep the rest of a partial write
+        while n:
+            if n >= len(buffers[0]):
+                n -= len(buffers[0])
+                buffers.pop(0)
+            else:
+                buffers[0] = buffers[0][n:]
+                n = 0
 
 
 class PatchBuffer(object):
@@ -187,48 +250,68 @@ class PatchBuffer(object):
         Attributes:
             name: String, filename to use when saving the patch
             filters: List of functions to map to the patch data
-            tpl: The patch template where the data will be written
-                 All data written to the PatchBuffer is placed in the
-                template variable %(data)s.
+            tpl: The patch header template, all data written to the
+                 PatchBuffer is placed after it.
+            footer: The patch footer template, placed after the data.
             ctx: Dictionary of values to be put replaced in the template.
             version_filename: Bool, version the filename if it already exists?
             modified: Bool (default=False), flag to check if the
                       PatchBuffer has been written to.
     """
 
-    def __init__(self, name, filters, tpl, ctx, version_filename=False):
+    def __init__(self, name, filters, tpl, ctx, version_filename=False, footer=''):
         """Inits the PatchBuffer class"""
         # self._buffer = cStringIO.StringIO()
-        self._buffer = io.StringIO()
+        # created on the first write, most runs find the schemas in sync
+        self._buffer = None
         self.name = name
         self.filters = filters
         self.tpl = tpl
+        self.footer = footer
         self.ctx = ctx
         self.version_filename = version_filename
         self.modified = False
 
     def write(self, data):
-        """Write data to the buffer."""
+        """Apply filters and write data to the buffer."""
         self.modified = True
+        if self._buffer is None:
+            # spill to disk once the patch grows over 1MB
+            self._buffer = tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode='w+',
+                                                           encoding='utf-8', newline='')
+        for f in self.filters:
+            data = f(data)
         self._buffer.write(data)
 
     def save(self):
-        """Apply filters, template transformations and write buffer to disk"""
-        data = self._buffer.getvalue()
-        if not data:
+        """Apply template transformations and write buffer to disk"""
+        if self._buffer is None:
+            return False
+
+        self._buffer.seek(0, os.SEEK_END)
+        if not self._buffer.tell():
             return False
 
         if self.version_filename:
             self.name = versioned(self.name)
-        fh = open(self.name, 'w')
-
-        for f in self.filters:
-            data = f(data)
-
-        self.ctx['data'] = data
 
-        fh.write(self.tpl % self.ctx)
-        fh.close()
+        self._buffer.seek(0)
+        fd = os.open(self.name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            # header, body chunks and footer go out together, a patch
+            # smaller than one chunk is written with a single syscall
+            data = [(self.tpl % self.ctx).encode('utf-8')]
+            chunk = self._buffer.read(WRITE_CHUNK_SIZE)
+            while chunk:
+                data.append(chunk.encode('utf-8'))
+                chunk = self._buffer.read(WRITE_CHUNK_SIZE)
+                if chunk:
+                    _write_buffers(fd, data)
+                    data = []
+            data.append((self.footer % self.ctx).encode('utf-8'))
+            _write_buffers(fd, data)
+        finally:
+            os.close(fd)
 
         return True
 
@@ -238,4 +321,5 @@ class PatchBuffer(object):
             os.unlink(self.name)
 
     def __del__(self):
-        self._buffer.close()
+        if self._buffer is not None:
+            self._buffer.close()